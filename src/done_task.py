@@ -10,140 +10,216 @@ from typing import List, Dict, Any
 import csv
 import os
 import sys
+import gc
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-import importlib.util
 
-"""study_plan.py を同ディレクトリのファイルパスから確実にロードする。
-通常のモジュール検索に依存せず、スクリプト直実行でも安定して動くようにする。
-"""
-# 該当ディレクトリにある候補ファイルを順に探す
-candidates = ['study_plan.py', 'first_study_plan.py']
-module = None
-found_path = None
-for name in candidates:
-    p = os.path.join(os.path.dirname(__file__), name)
-    if os.path.exists(p):
-        found_path = p
-        break
-
-if not found_path:
-    raise FileNotFoundError(f"study_plan.py / first_study_plan.py が見つかりません: {os.path.dirname(__file__)}")
-
-spec = importlib.util.spec_from_file_location('study_plan', found_path)
-module = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(module)
-# 必要な関数を取得（file により名前が異なる場合があるが候補内で互換性を保つ）
-allocate_by_priority = getattr(module, 'allocate_by_priority')
-prompt_and_save = getattr(module, 'prompt_and_save')
-print_plan = getattr(module, 'print_plan')
+try:
+    # スクリプト直実行や GUI からの利用では src/ が sys.path にあるので通常の import で足りる。
+    # 以前は旧名の study_plan.py を優先していたが、現在は first_study_plan だけを使う
+    from first_study_plan import allocate_by_priority, prompt_and_save, print_plan, plan_csv_rows
+except ImportError:
+    # 通常の import で見つからない場合だけ、同ディレクトリのファイルパスから確実にロードする。
+    import importlib.util
 
+    found_path = os.path.join(os.path.dirname(__file__), 'first_study_plan.py')
+    if not os.path.exists(found_path):
+        raise FileNotFoundError(f"first_study_plan.py が見つかりません: {os.path.dirname(__file__)}")
 
-def load_plan_csv(path: str) -> Dict[str, Any]:
-    """CSV（本ツールの出力形式）を読み込み、メタ／日別容量／プラン行を返す。"""
-    with open(path, newline='', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        rows = [r for r in reader]
+    spec = importlib.util.spec_from_file_location('first_study_plan', found_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # 必要な関数を取得
+    allocate_by_priority = getattr(module, 'allocate_by_priority')
+    prompt_and_save = getattr(module, 'prompt_and_save')
+    print_plan = getattr(module, 'print_plan')
+    plan_csv_rows = getattr(module, 'plan_csv_rows')
+
+
+def _to_int(s: str, default: Any = 0) -> Any:
+    """CSV のセル文字列を int に変換する。空文字や不正な値は default を返す。"""
+    if not s:
+        return default
+    try:
+        return int(s)
+    except ValueError:
+        return default
+
+
+def _to_float(s: str, default: Any = 0.0) -> Any:
+    """CSV のセル文字列を float に変換する。空文字や不正な値は default を返す。"""
+    if not s:
+        return default
+    try:
+        return float(s)
+    except ValueError:
+        return default
+
+
+@contextmanager
+def _gc_paused():
+    """循環参照を作らない小さなオブジェクトを大量に作る区間だけ循環 GC を止める。"""
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+# ファイル名に使えない文字を取り除くための変換表（str.translate 用）
+_SANITIZE_TABLE = str.maketrans('', '', '/\\:*?"<>|')
+
+
+# プラン行 (Day, Task, Assigned, Time(hours))。行ごとの dict より軽く、属性で参照できる。
+PlanRow = namedtuple('PlanRow', ['day', 'name', 'assigned', 'time'])
+
+
+# プラン CSV のセクション見出し
+_DAY_CAPS_HEADER = 'Day Capacities'
+_PLAN_HEADER = 'Plan'
 
-    i = 0
+# 解析済み CSV のキャッシュ: 絶対パス -> ((st_mtime_ns, st_size), 解析結果)
+_PARSE_CACHE: Dict[str, Any] = {}
+
+
+def load_plan_csv(path: str) -> Dict[str, Any]:
+    """CSV（本ツールの出力形式）を読み込み、メタ／日別容量／プラン行／Plan の最大 Day 番号を返す。
+
+    同じファイルを更新時刻とサイズが変わらないまま再度読み込んだ場合は
+    解析をやり直さず、前回の結果のコピーを返す。
+    """
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _PARSE_CACHE.get(key)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, _parse_plan_csv(path))
+        _PARSE_CACHE[key] = cached
+    data = cached[1]
+    # 呼び出し側が結果を書き換えてもキャッシュに影響しないようにコピーを返す
+    # （PlanRow は不変なので行オブジェクトはそのまま共有する）
+    return {
+        "meta": dict(data["meta"]),
+        "day_capacities": list(data["day_capacities"]),
+        "plan_rows": list(data["plan_rows"]),
+        "max_day": data["max_day"],
+    }
+
+
+def _parse_plan_csv(path: str) -> Dict[str, Any]:
+    """load_plan_csv の本体。
+
+    行を全件リストに展開せず、セクション単位の状態遷移で 1 行ずつ処理する。
+    """
     meta = {}
-    # メタ読み取り（先頭〜空行）
-    while i < len(rows) and rows[i]:
-        r = rows[i]
-        if len(r) >= 2:
-            meta[r[0]] = r[1]
-        i += 1
-
-    # 空行を飛ばす
-    while i < len(rows) and not rows[i]:
-        i += 1
-
-    # Day Capacities セクション
-    day_capacities = []
-    if i < len(rows) and rows[i] and rows[i][0].strip() == 'Day Capacities':
-        i += 1  # ヘッダ行
-        # 次行は列名 "Day", "AvailableHours"
-        i += 1
-        # CSV の Day 列は絶対番号になっている場合があるため、一旦辞書に格納してから
-        # 1..max_day までの配列に整形する。
-        tmp = {}
-        max_day = 0
-        while i < len(rows) and rows[i]:
-            r = rows[i]
-            try:
-                day_num = int(r[0])
-                hours = float(r[1])
-                tmp[day_num] = hours
-                if day_num > max_day:
-                    max_day = day_num
-            except Exception:
-                pass
-            i += 1
-        if max_day > 0:
-            # 1..max_day の長さのリストを作り、未指定日は 0.0 を入れる
-            day_capacities = [0.0] * max_day
-            for dn, h in tmp.items():
-                if 1 <= dn <= max_day:
-                    day_capacities[dn - 1] = h
-
-    # 空行を飛ばす
-    while i < len(rows) and not rows[i]:
-        i += 1
-
-    # Plan セクション
+    # CSV の Day 列は絶対番号になっている場合があるため、一旦辞書に格納してから
+    # 1..max_day までの配列に整形する。
+    caps_by_day = {}
+    max_cap_day = 0
     plan_rows = []
-    if i < len(rows) and rows[i] and rows[i][0].strip() == 'Plan':
-        i += 1  # ヘッダ行
-        # 列名行
-        i += 1
-        while i < len(rows) and rows[i]:
-            r = rows[i]
-            # 期待: Day, Task, Assigned, Time(hours)
-            try:
-                day = int(r[0])
-            except Exception:
-                i += 1
+    # Plan 行に現れた最大の Day 番号（行が無ければ None）
+    max_day = None
+
+    # state: 'meta'（先頭〜空行）→ 'between'（セクション間）→ 'caps' / 'plan'
+    state = 'meta'
+    seen_caps = False
+    skip_columns = False
+    with open(path, newline='', encoding='utf-8', buffering=1 << 20) as f, _gc_paused():
+        for r in csv.reader(f):
+            if skip_columns:
+                # セクション見出しの次行は列名 ("Day", "AvailableHours" など)
+                skip_columns = False
+                continue
+
+            if state == 'meta':
+                if not r:
+                    state = 'between'
+                elif len(r) >= 2:
+                    meta[r[0]] = r[1]
+                continue
+
+            if not r:
+                # Plan セクションの終わりで読み込みを終える
+                if state == 'plan':
+                    break
+                if state == 'caps':
+                    state = 'between'
+                continue
+
+            if state == 'between':
+                # セクション見出しの判定はセクションの切れ目でだけ行い、strip も 1 回で済ませる
+                header = r[0].strip()
+                if not seen_caps and header == _DAY_CAPS_HEADER:
+                    state = 'caps'
+                    seen_caps = True
+                    skip_columns = True
+                    continue
+                if header == _PLAN_HEADER:
+                    state = 'plan'
+                    skip_columns = True
+                    continue
+                # 想定外のセクション
+                break
+
+            if state == 'caps':
+                day_num = _to_int(r[0], None)
+                hours = _to_float(r[1], None) if len(r) > 1 else None
+                if day_num is not None and hours is not None:
+                    caps_by_day[day_num] = hours
+                    if day_num > max_cap_day:
+                        max_cap_day = day_num
+                continue
+
+            # Plan セクション 期待: Day, Task, Assigned, Time(hours)
+            day = _to_int(r[0], None)
+            if day is None:
                 continue
             name = r[1]
-            assigned = 0
-            try:
-                assigned = int(r[2]) if r[2] != '' else 0
-            except Exception:
-                assigned = 0
-            time_h = 0.0
-            try:
-                time_h = float(r[3]) if r[3] != '' else 0.0
-            except Exception:
-                time_h = 0.0
+            assigned = _to_int(r[2]) if len(r) > 2 else 0
+            time_h = _to_float(r[3]) if len(r) > 3 else 0.0
+
+            plan_rows.append(PlanRow(day, name, assigned, time_h))
+            if max_day is None or day > max_day:
+                max_day = day
 
-            plan_rows.append({"day": day, "name": name, "assigned": assigned, "time": time_h})
-            i += 1
+    day_capacities = []
+    if max_cap_day > 0:
+        # 1..max_day の長さのリストを作り、未指定日は 0.0 を入れる
+        day_capacities = [0.0] * max_cap_day
+        for dn, h in caps_by_day.items():
+            if 1 <= dn <= max_cap_day:
+                day_capacities[dn - 1] = h
 
-    return {"meta": meta, "day_capacities": day_capacities, "plan_rows": plan_rows}
+    return {"meta": meta, "day_capacities": day_capacities, "plan_rows": plan_rows, "max_day": max_day}
 
 
-def aggregate_tasks_from_plan(plan_rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+def aggregate_tasks_from_plan(plan_rows: List[PlanRow]) -> Dict[str, Dict[str, Any]]:
     """Plan 行からタスクごとの合計割当や 1問当たり時間を推定して返す。"""
     tasks = {}
     for r in plan_rows:
-        name = r["name"]
+        name = r.name
         # 空文字（以前は '(休憩/学習無し)' を使っていたケースもある）をスキップする
         if not str(name).strip():
             continue
-        assigned = int(r.get("assigned", 0))
-        time_h = float(r.get("time", 0.0))
-        if name not in tasks:
-            tasks[name] = {"total_assigned": 0, "time_per_item_samples": [], "first_day": r["day"]}
-        tasks[name]["total_assigned"] += assigned
+        assigned = int(r.assigned)
+        time_h = float(r.time)
+        info = tasks.get(name)
+        if info is None:
+            info = tasks[name] = {"total_assigned": 0, "sum_tpi": 0.0, "count_tpi": 0, "first_day": r.day}
+        info["total_assigned"] += assigned
         if assigned > 0:
-            tasks[name]["time_per_item_samples"].append(time_h / assigned)
+            # 1問当たり時間はサンプルを保持せず、合計と件数だけを積算する
+            info["sum_tpi"] += time_h / assigned
+            info["count_tpi"] += 1
         # first_day を最小化
-        tasks[name]["first_day"] = min(tasks[name]["first_day"], r["day"])
+        info["first_day"] = min(info["first_day"], r.day)
 
     # 平均で time_per_item を決定
-    for name, info in tasks.items():
-        samples = info["time_per_item_samples"]
-        time_per_item = (sum(samples) / len(samples)) if samples else 1.0
-        info["time_per_item"] = time_per_item
+    for info in tasks.values():
+        info["time_per_item"] = info["sum_tpi"] / info["count_tpi"] if info["count_tpi"] else 1.0
     return tasks
 
 
@@ -202,7 +278,7 @@ def run():
     tasks_info = aggregate_tasks_from_plan(plan_rows)
 
     # どの日を「今日」とするか
-    max_day = max((r["day"] for r in plan_rows), default=len(day_capacities))
+    max_day = data["max_day"] if data["max_day"] is not None else len(day_capacities)
     today = input(f"今日とする Day 番号を入力してください (1-{max_day}, デフォルト=1): ").strip()
     if today == "":
         today = 1
@@ -211,14 +287,21 @@ def run():
     if today < 1:
         today = 1
 
+    # タスクごとの過去／今日の割当合計を 1 回の走査で求めておく
+    prev_by_task = defaultdict(int)
+    today_by_task = defaultdict(int)
+    for r in plan_rows:
+        if r.day < today:
+            prev_by_task[r.name] += r.assigned
+        elif r.day == today:
+            today_by_task[r.name] += r.assigned
+
     # 各タスクについて提案値（その日の割当）を求め、ユーザーに完了数を入力してもらう
     completed_by_task = {}
     for name, info in tasks_info.items():
         total_assigned = info["total_assigned"]
-        # prev, today, future assigned
-        prev = sum(r["assigned"] for r in plan_rows if r["name"] == name and r["day"] < today)
-        today_assigned = sum(r["assigned"] for r in plan_rows if r["name"] == name and r["day"] == today)
-        future = sum(r["assigned"] for r in plan_rows if r["name"] == name and r["day"] > today)
+        prev = prev_by_task[name]
+        today_assigned = today_by_task[name]
         suggested = min(total_assigned - prev, today_assigned)
         if suggested < 0:
             suggested = 0
@@ -244,7 +327,7 @@ def run():
     remaining_tasks = []
     for name, info in tasks_info.items():
         total_assigned = info["total_assigned"]
-        prev = sum(r["assigned"] for r in plan_rows if r["name"] == name and r["day"] < today)
+        prev = prev_by_task[name]
         done_today = completed_by_task.get(name, {}).get("done_today", 0)
         remaining = total_assigned - prev - done_today
         if remaining < 0:
@@ -275,35 +358,39 @@ def run():
 
     # allocate
     # make a deepcopy-like copy so allocate_by_priority can mutate remaining
-    tasks_for_alloc = []
-    for t in remaining_tasks:
-        tasks_for_alloc.append({
-            "name": t["name"],
-            "remaining": t["remaining"],
-            "total": t["remaining"],
-            "time_per_item": t["time_per_item"],
-            "difficulty": t["difficulty"],
-            "priority": t["priority"],
-        })
-
-    total_needed = sum(t["remaining"] * t["time_per_item"] * t.get("difficulty", 1.0) for t in tasks_for_alloc)
-    plan = allocate_by_priority(next_day_caps, tasks_for_alloc)
+    with _gc_paused():
+        tasks_for_alloc = []
+        for t in remaining_tasks:
+            tasks_for_alloc.append({
+                "name": t["name"],
+                "remaining": t["remaining"],
+                "total": t["remaining"],
+                "time_per_item": t["time_per_item"],
+                "difficulty": t["difficulty"],
+                "priority": t["priority"],
+            })
+
+        total_needed = sum(t["remaining"] * t["time_per_item"] * t.get("difficulty", 1.0) for t in tasks_for_alloc)
+        plan = allocate_by_priority(next_day_caps, tasks_for_alloc)
 
     start_day = today + 1
 
     print('\n=== 再計画結果 ===')
     # Day 表示を元の絶対日付番号に合わせて表示するヘルパー
     def print_plan_with_offset(subject_name, start_day_num, day_caps, tasks_list, total_need, plan_list, base_date=None, test_date=None):
+        # 1 行ずつ print せず、まとめて 1 回で書き出す
+        lines = []
         days = len(day_caps)
-        print('\n' + '='*40)
-        print(f"科目: {subject_name}")
-        print(f"合計利用可能時間: {sum(day_caps):.2f} 時間")
-        print(f"必要な総学習時間: {total_need:.2f} 時間")
-        print(f"学習日数: {days} (Day {start_day_num} から Day {start_day_num + days - 1} まで)")
-        print('='*40 + '\n')
-
-        print("各日の利用可能時間:")
-        for i, h in enumerate(day_caps, start=0):
+        lines.append('\n' + '='*40)
+        lines.append(f"科目: {subject_name}")
+        lines.append(f"合計利用可能時間: {sum(day_caps):.2f} 時間")
+        lines.append(f"必要な総学習時間: {total_need:.2f} 時間")
+        lines.append(f"学習日数: {days} (Day {start_day_num} から Day {start_day_num + days - 1} まで)")
+        lines.append('='*40 + '\n')
+
+        # Day ラベルは容量一覧とプラン本体の両方で使うので先にまとめて作る
+        labels = []
+        for i in range(max(days, len(plan_list))):
             label = f"Day {start_day_num + i}"
             if base_date is not None:
                 day_date = base_date + timedelta(days=(start_day_num + i - 1))
@@ -314,33 +401,30 @@ def run():
                     days_left = (test_date - day_date).days
                     rem = f"　テストまで残り{days_left}日"
                 label = f"{label} ({date_str}{rem})"
-            print(f"  {label}: {h:.2f} 時間")
-        print('')
+            labels.append(label)
+
+        lines.append("各日の利用可能時間:")
+        for label, h in zip(labels, day_caps):
+            lines.append(f"  {label}: {h:.2f} 時間")
+        lines.append('')
 
         if total_need <= sum(day_caps):
-            print("すべてのタスクを完了するための十分な時間があります。\n")
+            lines.append("すべてのタスクを完了するための十分な時間があります。\n")
         else:
-            print("注意: 利用可能時間より必要時間が多いです。計画を調整してください。\n")
+            lines.append("注意: 利用可能時間より必要時間が多いです。計画を調整してください。\n")
 
-        for i, day_tasks in enumerate(plan_list, start=0):
-            label = f"Day {start_day_num + i}"
-            if base_date is not None:
-                day_date = base_date + timedelta(days=(start_day_num + i - 1))
-                date_str = f"{day_date.month}/{day_date.day}"
-                rem = ''
-                if test_date is not None:
-                    days_left = (test_date - day_date).days
-                    rem = f"　テストまで残り{days_left}日"
-                label = f"{label} ({date_str}{rem})"
-            print(f"{label}:")
+        for label, day_tasks in zip(labels, plan_list):
+            lines.append(f"{label}:")
             # For days without assignments, do not print a "rest" placeholder.
             if not day_tasks:
                 # leave the day header but no task lines
                 pass
             else:
                 for it in day_tasks:
-                    print(f"  - {it['name']} を {it['assigned']} 問（合計 {it['time']:.2f} 時間）")
-            print('')
+                    lines.append(f"  - {it['name']} を {it['assigned']} 問（合計 {it['time']:.2f} 時間）")
+            lines.append('')
+
+        sys.stdout.write('\n'.join(lines) + '\n')
 
     print_plan_with_offset(subject + ' (継続)', start_day, next_day_caps, tasks_for_alloc, total_needed, plan, base_date=start_date, test_date=test_date)
 
@@ -354,8 +438,7 @@ def run():
         if user_name == "":
             basename = f"study_plan_{subject}_continued_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         else:
-            bad = set(list('/\\:*?"<>|'))
-            safe = ''.join(ch for ch in user_name if ch not in bad)
+            safe = user_name.translate(_SANITIZE_TABLE)
             if not safe.lower().endswith('.csv'):
                 safe = safe + '.csv'
             basename = safe
@@ -368,35 +451,30 @@ def run():
                 return
 
         # CSV 書き出し（Day 番号は start_day をオフセットして出力）
-        with open(path, 'w', newline='', encoding='utf-8') as f:
+        with open(path, 'w', newline='', encoding='utf-8', buffering=1 << 20) as f:
             writer = csv.writer(f)
-            writer.writerow(["subject", subject + ' (継続)'])
-            writer.writerow(["generated_at", datetime.now().isoformat()])
-            writer.writerow(["total_available", f"{sum(next_day_caps):.2f}"])
-            writer.writerow(["total_needed", f"{total_needed:.2f}"])
+            meta_rows = [
+                ["subject", subject + ' (継続)'],
+                ["generated_at", datetime.now().isoformat()],
+                ["total_available", f"{sum(next_day_caps):.2f}"],
+                ["total_needed", f"{total_needed:.2f}"],
+            ]
             # 新しい開始日をメタに含める（元 start_date があればそれをオフセット）
             if start_date is not None:
                 new_start_date = start_date + timedelta(days=(start_day - 1))
-                writer.writerow(["start_date", new_start_date.isoformat()])
+                meta_rows.append(["start_date", new_start_date.isoformat()])
             if test_date is not None:
-                writer.writerow(["test_date", test_date.isoformat()])
-            writer.writerow([])
+                meta_rows.append(["test_date", test_date.isoformat()])
+            meta_rows.append([])
+            writer.writerows(meta_rows)
 
-            writer.writerow(["Day Capacities"])
-            writer.writerow(["Day", "AvailableHours"])
-            for i, h in enumerate(next_day_caps, start=0):
-                writer.writerow([start_day + i, f"{h:.2f}"])
+            writer.writerows([["Day Capacities"], ["Day", "AvailableHours"]])
+            writer.writerows([start_day + i, f"{h:.2f}"] for i, h in enumerate(next_day_caps, start=0))
             writer.writerow([])
 
-            writer.writerow(["Plan"])
-            writer.writerow(["Day", "Task", "Assigned", "Time(hours)"])
-            for i, day_tasks in enumerate(plan, start=0):
-                if not day_tasks:
-                    # 割当がない日の CSV 行ではタスク名を空文字で出力する
-                    writer.writerow([start_day + i, "", "", ""])
-                else:
-                    for it in day_tasks:
-                        writer.writerow([start_day + i, it["name"], it["assigned"], f"{it['time']:.2f}"])
+            writer.writerows([["Plan"], ["Day", "Task", "Assigned", "Time(hours)"]])
+            # 割当がない日の CSV 行ではタスク名を空文字で出力する
+            writer.writerows(plan_csv_rows(plan, start_day))
 
         print(f"プランを保存しました: {path}")
 
@@ -6,10 +6,9 @@
  - 優先度の高いタスクから、各日ごとに可能な問題数を割り当てます
 """
 
-from math import floor
-import json
 import csv
 import os
+import sys
 from datetime import datetime
 
 # --- オプション: ファイル内で値を定義して対話入力をスキップできます ---
@@ -38,6 +37,10 @@ TEST_DATE_PRESET = "2025-12-08"
 # ------------------------------------------------------------------
 
 
+# ファイル名に使えない文字を取り除くための変換表（str.translate 用）
+_SANITIZE_TABLE = str.maketrans('', '', '/\\:*?"<>|')
+
+
 def prompt_float(prompt, default=None):
     while True:
         try:
@@ -86,10 +89,8 @@ def collect_inputs():
 
 
 def compute_total_time(tasks):
-    total = 0.0
-    for t in tasks:
-        total += t["total"] * t["time_per_item"] * t["difficulty"]
-    return total
+    # 合計は組み込みの sum に任せる（タスクが空なら 0.0）
+    return float(sum(t["total"] * t["time_per_item"] * t["difficulty"] for t in tasks))
 
 
 def allocate_by_priority(day_capacities, tasks):
@@ -100,36 +101,64 @@ def allocate_by_priority(day_capacities, tasks):
     days = len(day_capacities)
     plan = [[] for _ in range(days)]
 
+    # 割当中はタスク dict を直接触らず、添字で引く並列リストで残数などを管理し、
+    # 最後に残数だけを各タスクへ書き戻す。
+    # 1問あたりの所要時間はタスクごとに一度だけ計算しておき、
+    # 所要時間が不正なタスクや残数の無いタスクは最初から除外する。
+    names = []
+    priorities = []
+    remaining = []
+    time_pers = []
+    active_tasks = []
+    for t in tasks:
+        time_per = t.get("time_per_item", 0) * t.get("difficulty", 1.0)
+        if time_per > 0 and t.get("remaining", 0) > 0:
+            names.append(t["name"])
+            priorities.append(t.get("priority", 99))
+            remaining.append(t["remaining"])
+            time_pers.append(time_per)
+            active_tasks.append(t)
+    active = list(range(len(active_tasks)))
+
+    def sort_key(i):
+        # 優先度（小さい値が高優先度）→ 残数（大きいもの優先）の順
+        return (priorities[i], -int(remaining[i]))
+
+    # 優先度がすべて異なる場合（よくある入力）は残数による並べ替えが効かず順序が変わらないので、
+    # 優先度順の並びを最初に 1 度だけ作り、各パスでは残数の無いタスクを除くだけにする
+    static_order = len(set(priorities)) == len(priorities)
+    if static_order:
+        active.sort(key=priorities.__getitem__)
+
     # 各日を先頭から処理していく
     for day in range(days):
         remaining_time = float(day_capacities[day])
         any_assigned_today = False
+        day_plan = plan[day]
 
         # その日の割当ループ：毎パスで優先度順に並べ替えて割当を試みる
         while True:
             assigned_in_pass = False
 
-            # 優先度（小さい値が高優先度）→ 残数（大きいもの優先）の順でソート
-            tasks_sorted = sorted(tasks, key=lambda x: (x.get("priority", 99), -int(x.get("remaining", 0))))
-
-            for t in tasks_sorted:
-                if t.get("remaining", 0) <= 0:
-                    continue
-                time_per = t.get("time_per_item", 0) * t.get("difficulty", 1.0)
-                if time_per <= 0:
-                    # 所要時間が不正ならスキップ
-                    continue
+            # 残数が無くなったタスクは以降の走査対象から外す
+            active = [i for i in active if remaining[i] > 0]
+            if not active:
+                break
+            order = active if static_order else sorted(active, key=sort_key)
 
+            for i in order:
+                time_per = time_pers[i]
                 # その日の残時間に何問入るか
                 if remaining_time >= time_per:
-                    max_items = int(floor(remaining_time / time_per))
-                    assign = min(max_items, t["remaining"])
+                    # remaining_time >= time_per > 0 なので int() の切り捨てが floor と一致する
+                    max_items = int(remaining_time / time_per)
+                    assign = min(max_items, remaining[i])
                     if assign <= 0:
                         continue
                     # 割当
-                    t["remaining"] -= assign
+                    remaining[i] -= assign
                     remaining_time -= assign * time_per
-                    plan[day].append({"name": t["name"], "assigned": assign, "time": assign * time_per})
+                    day_plan.append({"name": names[i], "assigned": assign, "time": assign * time_per})
                     assigned_in_pass = True
                     any_assigned_today = True
                 # 余裕がない場合は次のタスクを試す
@@ -138,70 +167,73 @@ def allocate_by_priority(day_capacities, tasks):
             # まだタスクが残っていれば "最低1問" ルールで1問を割り当てる
             if not assigned_in_pass:
                 # まだ割当が1件も無く、日として多少の時間がある場合は1問だけ割当
+                # （このパスでは何も割り当てていないので order の順序はそのまま使える）
                 if (not any_assigned_today) and remaining_time > 0:
-                    # 同様に優先度順で1問だけ割当
-                    tasks_sorted = sorted(tasks, key=lambda x: (x.get("priority", 99), -int(x.get("remaining", 0))))
-                    for t in tasks_sorted:
-                        if t.get("remaining", 0) <= 0:
-                            continue
-                        time_per = t.get("time_per_item", 0) * t.get("difficulty", 1.0)
-                        if time_per <= 0:
-                            continue
-                        # 1問割り当て（残時間が足りなくても強制割当）
-                        t["remaining"] -= 1
-                        remaining_time -= time_per
-                        plan[day].append({"name": t["name"], "assigned": 1, "time": time_per})
-                        any_assigned_today = True
-                        assigned_in_pass = True
-                        break
+                    i = order[0]
+                    # 1問割り当て（残時間が足りなくても強制割当）
+                    remaining[i] -= 1
+                    remaining_time -= time_pers[i]
+                    day_plan.append({"name": names[i], "assigned": 1, "time": time_pers[i]})
+                    any_assigned_today = True
+                    assigned_in_pass = True
 
             # もう割当できるものが無ければこの日の処理を終える
             if not assigned_in_pass:
                 break
 
+    for t, rem in zip(active_tasks, remaining):
+        t["remaining"] = rem
+
     return plan
 
 
 def print_plan(subject, total_available, day_capacities, tasks, total_needed, plan):
+    # 1 行ずつ print せず、まとめて 1 回で書き出す
+    lines = []
     days = len(day_capacities)
-    print('\n' + '='*40)
-    print(f"科目: {subject}")
-    print(f"合計利用可能時間: {total_available:.2f} 時間")
-    print(f"必要な総学習時間: {total_needed:.2f} 時間")
-    print(f"学習日数: {days}")
-    print('='*40 + '\n')
-
-    print("各日の利用可能時間:")
+    lines.append('\n' + '='*40)
+    lines.append(f"科目: {subject}")
+    lines.append(f"合計利用可能時間: {total_available:.2f} 時間")
+    lines.append(f"必要な総学習時間: {total_needed:.2f} 時間")
+    lines.append(f"学習日数: {days}")
+    lines.append('='*40 + '\n')
+
+    lines.append("各日の利用可能時間:")
     for i, h in enumerate(day_capacities, start=1):
-        print(f"  Day {i}: {h:.2f} 時間")
-    print('')
+        lines.append(f"  Day {i}: {h:.2f} 時間")
+    lines.append('')
 
     if total_needed <= total_available:
-        print("すべてのタスクを完了するための十分な時間があります。\n")
+        lines.append("すべてのタスクを完了するための十分な時間があります。\n")
     else:
-        print("注意: 利用可能時間より必要時間が多いです。計画を調整してください。\n")
+        lines.append("注意: 利用可能時間より必要時間が多いです。計画を調整してください。\n")
 
     for i, day_tasks in enumerate(plan, start=1):
-        print(f"Day {i}:")
+        lines.append(f"Day {i}:")
         if not day_tasks:
             # 空日はプレースホルダを出さず、タスク行を出力しない
             pass
         else:
             for it in day_tasks:
-                print(f"  - {it['name']} を {it['assigned']} 問（合計 {it['time']:.2f} 時間）")
-        print('')
+                lines.append(f"  - {it['name']} を {it['assigned']} 問（合計 {it['time']:.2f} 時間）")
+        lines.append('')
 
     # 残りタスクを表示
     remaining = [t for t in tasks if t["remaining"] > 0]
     if remaining:
-        print("割り当て後に残ったタスク:")
+        lines.append("割り当て後に残ったタスク:")
         for t in remaining:
             est = t["remaining"] * t["time_per_item"] * t["difficulty"]
-            print(f"  - {t['name']}: 残り {t['remaining']} 問（推定 {est:.2f} 時間）")
-        print('\n利用可能時間内に収めるには、問題数を減らすか、1問あたりの時間/難易度を見直してください。')
+            lines.append(f"  - {t['name']}: 残り {t['remaining']} 問（推定 {est:.2f} 時間）")
+        lines.append('\n利用可能時間内に収めるには、問題数を減らすか、1問あたりの時間/難易度を見直してください。')
+
+    sys.stdout.write('\n'.join(lines) + '\n')
 
 
 def _export_plan_json(path, subject, day_capacities, plan):
+    # JSON 出力は通常の実行経路では使わないので、json は必要になった時だけ読み込む
+    import json
+
     data = {
         "subject": subject,
         "generated_at": datetime.now().isoformat(),
@@ -217,45 +249,52 @@ def _export_plan_json(path, subject, day_capacities, plan):
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
+def plan_csv_rows(plan, start_day=1):
+    # Plan セクションの行 (Day, Task, Assigned, Time(hours)) を順に返す。
+    # Day 番号は start_day から数える。
+    for i, day_tasks in enumerate(plan, start=start_day):
+        if not day_tasks:
+            # 以前は空日の行でプレースホルダを書いていたが、現在はタスク名を空文字で出力する
+            yield [i, "", "", ""]
+        else:
+            for it in day_tasks:
+                yield [i, it["name"], it["assigned"], f"{it['time']:.2f}"]
+
+
 def _export_plan_csv(path, subject, day_capacities, tasks, total_needed, plan):
     # CSV にメタ情報、日別容量、プラン、最後に人間向けレポート行をまとめて書く
-    with open(path, 'w', newline='', encoding='utf-8') as f:
+    # 行はセクションごとに writerows でまとめて書き、ファイルは大きめのバッファで開く
+    with open(path, 'w', newline='', encoding='utf-8', buffering=1 << 20) as f:
         writer = csv.writer(f)
         # メタ情報
-        writer.writerow(["subject", subject])
-        writer.writerow(["generated_at", datetime.now().isoformat()])
-        writer.writerow(["total_available", f"{sum(day_capacities):.2f}"])
-        writer.writerow(["total_needed", f"{total_needed:.2f}"])
+        meta_rows = [
+            ["subject", subject],
+            ["generated_at", datetime.now().isoformat()],
+            ["total_available", f"{sum(day_capacities):.2f}"],
+            ["total_needed", f"{total_needed:.2f}"],
+        ]
         # 日付メタ（オプション）
         try:
             if START_DATE_PRESET is not None:
-                writer.writerow(["start_date", str(START_DATE_PRESET)])
+                meta_rows.append(["start_date", str(START_DATE_PRESET)])
         except NameError:
             pass
         try:
             if TEST_DATE_PRESET is not None:
-                writer.writerow(["test_date", str(TEST_DATE_PRESET)])
+                meta_rows.append(["test_date", str(TEST_DATE_PRESET)])
         except NameError:
             pass
-        writer.writerow([])
+        meta_rows.append([])
+        writer.writerows(meta_rows)
 
         # 日別容量セクション
-        writer.writerow(["Day Capacities"])
-        writer.writerow(["Day", "AvailableHours"])
-        for i, h in enumerate(day_capacities, start=1):
-            writer.writerow([i, f"{h:.2f}"])
+        writer.writerows([["Day Capacities"], ["Day", "AvailableHours"]])
+        writer.writerows([i, f"{h:.2f}"] for i, h in enumerate(day_capacities, start=1))
         writer.writerow([])
 
         # プラン本体
-        writer.writerow(["Plan"])
-        writer.writerow(["Day", "Task", "Assigned", "Time(hours)"])
-        for i, day_tasks in enumerate(plan, start=1):
-            if not day_tasks:
-                # 以前は空日の行でプレースホルダを書いていたが、現在はタスク名を空文字で出力する
-                writer.writerow([i, "", "", ""])
-            else:
-                for it in day_tasks:
-                    writer.writerow([i, it["name"], it["assigned"], f"{it['time']:.2f}"])
+        writer.writerows([["Plan"], ["Day", "Task", "Assigned", "Time(hours)"]])
+        writer.writerows(plan_csv_rows(plan))
         writer.writerow([])
 
         # (Remaining セクションは不要のため出力しない)
@@ -311,8 +350,7 @@ def prompt_and_save(subject, day_capacities, plan, tasks, total_needed):
         basename = f"study_plan_{subject}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     else:
         # サニタイズ: 基本的にファイル名に使えない文字を除去
-        bad = set(list('/\\:*?"<>|'))
-        safe = ''.join(ch for ch in user_name if ch not in bad)
+        safe = user_name.translate(_SANITIZE_TABLE)
         if not safe.lower().endswith('.csv'):
             safe = safe + '.csv'
         basename = safe
@@ -3,33 +3,104 @@
 使い方:
     python src/plan_gui.py
 
-注意: この GUI は `first_study_plan.py` と `done_task.py` の関数を動的にロードして利用します。
+注意: この GUI は `first_study_plan.py` と `done_task.py` の関数を利用します。
+src/ を import パスに加えて通常の import で読み込み、import できない場合だけ
+ファイルパスから動的にロードします。
 """
 import os
+import re
+import sys
 import csv
 import importlib.util
-from datetime import datetime, timedelta
+from collections import defaultdict, namedtuple
+from itertools import groupby
+from operator import attrgetter
+from datetime import date, datetime, timedelta
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, scrolledtext
+from tkinter import ttk, filedialog, messagebox, scrolledtext, simpledialog
 
 
 SRC_DIR = os.path.dirname(__file__)
 PLANS_DIR = os.path.abspath(os.path.join(SRC_DIR, '..', 'plans'))
 os.makedirs(PLANS_DIR, exist_ok=True)
 
+# 新規プラン入力欄の解析用
+# 日ごとの利用可能時間: カンマ・改行区切り（各項目は _to_float で数値として解釈する）
+_CAP_SPLIT_RE = re.compile(r'[,\n]')
+_NUM = r'[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?'
+# タスク: 1行1件 "名前,合計問題数,優先順位,問題コスト"（5列目以降は無視）
+# 各項目の前後の空白（全角スペースを含む）は無視する。[^\S\n] は改行以外の空白で、行をまたいで一致させないため
+_TASK_RE = re.compile(r'^[^\S\n]*([^,\n]*?)[^\S\n]*,[^\S\n]*([-+]?\d+)[^\S\n]*,[^\S\n]*([-+]?\d+)[^\S\n]*,[^\S\n]*(' + _NUM + r')[^\S\n]*(?:,.*)?$', re.M)
+
+
+# セル・入力欄の数値判定（例外に頼らず、形を先に確かめてから変換する）
+# 同じ CSV セルがどちらのローダーでも同じ値になるよう、done_task._to_int/_to_float と同じ値を
+# 受け付ける（float は nan/inf も可）。違いは前後の空白を除くことと、桁区切りの '_' を受け付けないことだけ
+_INT_FULL_RE = re.compile(r'[-+]?\d+')
+_FLOAT_FULL_RE = re.compile(_NUM + r'|[-+]?(?:inf(?:inity)?|nan)', re.IGNORECASE)
+
+
+def _to_int(s, default=0):
+    # 空欄や数値でないセル・入力は default を返す
+    s = s.strip()
+    return int(s) if _INT_FULL_RE.fullmatch(s) else default
+
+
+def _to_float(s, default=0.0):
+    s = s.strip()
+    return float(s) if _FLOAT_FULL_RE.fullmatch(s) else default
+
+
+def _csv_quote(value):
+    # csv.writer の既定（QUOTE_MINIMAL）と同じ規則で 1 フィールドを整形する
+    value = str(value)
+    if ',' in value or '"' in value or '\r' in value or '\n' in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _plan_csv_head(meta_rows, day_caps):
+    # Plan 行より前の固定形式の部分（メタ情報・日別容量・Plan 見出し）を
+    # csv.writer と同じ書式（区切り , / 改行 \r\n）の文字列として組み立てる
+    lines = [f"{key},{_csv_quote(value)}" for key, value in meta_rows]
+    lines += ['', 'Day Capacities', 'Day,AvailableHours']
+    lines.extend(f"{i},{h:.2f}" for i, h in enumerate(day_caps, start=1))
+    lines += ['', 'Plan', 'Day,Task,Assigned,Time(hours)', '']
+    return '\r\n'.join(lines)
+
 
 def load_module(name, filename):
+    # 読み込み済みならそのモジュールを使い回す
+    mod = sys.modules.get(name)
+    if mod is not None:
+        return mod
     path = os.path.join(SRC_DIR, filename)
     if not os.path.exists(path):
         return None
     spec = importlib.util.spec_from_file_location(name, path)
     mod = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(mod)
+    sys.modules[name] = mod
+    try:
+        spec.loader.exec_module(mod)
+    except BaseException:
+        sys.modules.pop(name, None)
+        raise
     return mod
 
 
-first_mod = load_module('first_study_plan', 'first_study_plan.py')
-done_mod = load_module('done_task', 'done_task.py')
+# src を import パスに入れて通常の import（.pyc キャッシュが効く）で読み込む
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+try:
+    import first_study_plan as first_mod
+except ImportError:
+    first_mod = load_module('first_study_plan', 'first_study_plan.py')
+try:
+    import done_task as done_mod
+except ImportError:
+    done_mod = load_module('done_task', 'done_task.py')
+# done_task.load_plan_csv が返すプラン行と同じ形（done_task.py が無い場合の簡易ローダー用）
+PlanRow = getattr(done_mod, 'PlanRow', None) or namedtuple('PlanRow', ['day', 'name', 'assigned', 'time'])
 
 
 class PlannerGUI(tk.Tk):
@@ -124,28 +195,13 @@ class PlannerGUI(tk.Tk):
         subject = self.entry_subject.get().strip()
         start_date = self.entry_start.get().strip() or None
         test_date = self.entry_test.get().strip() or None
-        try:
-            time_per = float(self.entry_time_per.get().strip())
-        except Exception:
-            time_per = 0.0
-        caps_s = self.text_day_caps.get('1.0', 'end').strip()
-        day_caps = []
-        if caps_s:
-            for part in caps_s.replace('\n',',').split(','):
-                part = part.strip()
-                if not part: continue
-                try:
-                    day_caps.append(float(part))
-                except Exception:
-                    pass
-        tasks = []
-        for line in self.text_tasks.get('1.0','end').splitlines():
-            if not line.strip(): continue
-            parts = [p.strip() for p in line.split(',')]
-            if len(parts) < 4:
-                continue
-            name, total, priority, difficulty = parts[0], int(parts[1]), int(parts[2]), float(parts[3])
-            tasks.append({'name': name, 'remaining': total, 'total': total, 'time_per_item': time_per, 'difficulty': difficulty, 'priority': priority})
+        time_per = _to_float(self.entry_time_per.get())
+        # Text の末尾に自動で付く改行は 'end-1c' で除いて取得する
+        # 数値として読めない項目は読み飛ばす
+        day_caps = [h for h in (_to_float(part, None) for part in _CAP_SPLIT_RE.split(self.text_day_caps.get('1.0', 'end-1c'))) if h is not None]
+        # 形式に合わない行は読み飛ばす（行に分割せず、バッファを正規表現で 1 回だけ走査する）
+        tasks = [{'name': name, 'remaining': int(total), 'total': int(total), 'time_per_item': time_per, 'difficulty': float(difficulty), 'priority': int(priority)}
+                 for name, total, priority, difficulty in (m.groups() for m in _TASK_RE.finditer(self.text_tasks.get('1.0', 'end-1c')))]
         return subject, start_date, test_date, day_caps, tasks
 
     def _generate_plan(self):
@@ -155,9 +211,8 @@ class PlannerGUI(tk.Tk):
             return
         # use allocate_by_priority from first_mod if present
         if first_mod and hasattr(first_mod, 'allocate_by_priority'):
-            # copy tasks for mutation
-            import copy
-            tasks_copy = copy.deepcopy(tasks)
+            # copy tasks for mutation（値はすべて str/int/float なので浅いコピーで十分）
+            tasks_copy = [dict(t) for t in tasks]
             plan = first_mod.allocate_by_priority(day_caps, tasks_copy)
             total_needed = sum(t['total'] * t['time_per_item'] * t.get('difficulty',1.0) for t in tasks)
         else:
@@ -184,31 +239,35 @@ class PlannerGUI(tk.Tk):
             warning_msg += "\n\n各日の勉強時間を増やすか、タスクの優先度・難易度を調整してください。"
             messagebox.showwarning('時間不足', warning_msg)
 
-        # show
-        self.txt_out.delete('1.0','end')
-        self.txt_out.insert('end', f"科目: {subject}\n開始: {start_date}\nテスト: {test_date}\n\n")
         # show (original line-by-line per day)
         self.generated = plan
         self.generated_meta = {'subject': subject, 'start_date': start_date, 'test_date': test_date, 'day_caps': day_caps, 'tasks': tasks, 'total_needed': total_needed}
-        self.txt_out.delete('1.0','end')
-        self.txt_out.insert('end', f"科目: {subject}\n開始: {start_date}\nテスト: {test_date}\n\n")
-        for i, day_tasks in enumerate(plan, start=1):
-            label = f"Day {i}"
-            if start_date:
-                try:
-                    base = datetime.fromisoformat(start_date).date()
-                    day_date = base + timedelta(days=(i-1))
-                    label += f" ({day_date.month}/{day_date.day})"
-                except Exception:
-                    pass
-            self.txt_out.insert('end', f"{label}:\n")
+        # 表示内容はまとめて組み立て、ウィジェットへの insert は 1 回で済ませる
+        parts = [f"科目: {subject}\n開始: {start_date}\nテスト: {test_date}\n\n"]
+        # 日付ラベルは開始日を 1 回だけ解析し、序数（toordinal）の加算で先にまとめて作る
+        labels = [f"Day {i}" for i in range(1, len(plan)+1)]
+        base_ord = None
+        if start_date:
+            try:
+                base_ord = datetime.fromisoformat(start_date).date().toordinal()
+            except ValueError:
+                pass
+        if base_ord is not None:
+            # date.max を超える日はラベルに日付を付けない
+            for i in range(min(len(plan), date.max.toordinal() - base_ord + 1)):
+                day_date = date.fromordinal(base_ord + i)
+                labels[i] += f" ({day_date.month}/{day_date.day})"
+        for label, day_tasks in zip(labels, plan):
+            parts.append(f"{label}:\n")
             if not day_tasks:
                 # 空日の表示では「休憩」のプレースホルダを出さず、何も書かない
                 pass
             else:
                 for it in day_tasks:
-                    self.txt_out.insert('end', f"  - {it['name']} を {it['assigned']} 問 合計 {it['time']:.2f} 時間\n")
-            self.txt_out.insert('end','\n')
+                    parts.append(f"  - {it['name']} を {it['assigned']} 問 合計 {it['time']:.2f} 時間\n")
+            parts.append('\n')
+        self.txt_out.delete('1.0','end')
+        self.txt_out.insert('end', ''.join(parts))
 
     def _save_generated_plan(self):
         if not self.generated or not self.generated_meta:
@@ -220,31 +279,21 @@ class PlannerGUI(tk.Tk):
         # write CSV similar to first_study_plan format, include start_date/test_date
         meta = self.generated_meta
         plan = self.generated
-        with open(fname, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['subject', meta['subject']])
-            writer.writerow(['generated_at', datetime.now().isoformat()])
-            writer.writerow(['total_available', f"{sum(meta['day_caps']):.2f}"])
-            writer.writerow(['total_needed', f"{meta['total_needed']:.2f}"])
-            if meta.get('start_date'):
-                writer.writerow(['start_date', meta['start_date']])
-            if meta.get('test_date'):
-                writer.writerow(['test_date', meta['test_date']])
-            writer.writerow([])
-            writer.writerow(['Day Capacities'])
-            writer.writerow(['Day','AvailableHours'])
-            for i,h in enumerate(meta['day_caps'], start=1):
-                writer.writerow([i, f"{h:.2f}"])
-            writer.writerow([])
-            writer.writerow(['Plan'])
-            writer.writerow(['Day','Task','Assigned','Time(hours)'])
-            for i, day_tasks in enumerate(plan, start=1):
-                if not day_tasks:
-                    # 割当がない日はタスク名を空文字で CSV に出力する
-                    writer.writerow([i, '', '', ''])
-                else:
-                    for it in day_tasks:
-                        writer.writerow([i, it['name'], it['assigned'], f"{it['time']:.2f}"])
+        meta_rows = [
+            ('subject', meta['subject']),
+            ('generated_at', datetime.now().isoformat()),
+            ('total_available', f"{sum(meta['day_caps']):.2f}"),
+            ('total_needed', f"{meta['total_needed']:.2f}"),
+        ]
+        if meta.get('start_date'):
+            meta_rows.append(('start_date', meta['start_date']))
+        if meta.get('test_date'):
+            meta_rows.append(('test_date', meta['test_date']))
+        # 形式が決まっている先頭部分は文字列で直接書き、タスク名を含む Plan 行だけ csv.writer に任せる
+        # （割当がない日はタスク名を空文字で CSV に出力する）
+        with open(fname, 'w', newline='', encoding='utf-8', buffering=1 << 20) as f:
+            f.write(_plan_csv_head(meta_rows, meta['day_caps']))
+            csv.writer(f).writerows(first_mod.plan_csv_rows(plan))
         messagebox.showinfo('保存完了', f'プランを保存しました: {fname}')
 
     # -- update tab
@@ -274,52 +323,39 @@ class PlannerGUI(tk.Tk):
             plan_data = done_mod.load_plan_csv(fpath)
         else:
             # simple loader
+            # 空行で区切られたセクション（メタ情報 / Day Capacities / Plan）ごとにまとめて読む
             with open(fpath, newline='', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                rows = [r for r in reader]
-            # minimal parse: reuse code from done_task (lightweight)
-            i=0; meta={}
-            while i < len(rows) and rows[i]:
-                r=rows[i]
-                if len(r)>=2: meta[r[0]]=r[1]
-                i+=1
-            while i < len(rows) and not rows[i]: i+=1
+                groups = [(k, list(g)) for k, g in groupby(csv.reader(f), key=bool)]
+            sections = iter([g for k, g in groups if k])
+            # 先頭行が空でない場合だけ、最初のセクションをメタ情報として扱う
+            # （空行で始まるファイルはメタ情報なしで Day Capacities から始まる）
+            meta = {}
+            if groups and groups[0][0]:
+                meta = dict(r[:2] for r in next(sections) if len(r) >= 2)
+            sec = next(sections, None)
             day_caps=[]
-            if i < len(rows) and rows[i] and rows[i][0].strip()=='Day Capacities':
-                i+=2
+            if sec and sec[0][0].strip()=='Day Capacities':
                 # 同様に Day 列は絶対番号の可能性があるため辞書経由で整形する
                 tmp = {}
-                max_day = 0
-                while i < len(rows) and rows[i]:
-                    try:
-                        dn = int(rows[i][0])
-                        h = float(rows[i][1])
+                for r in sec[2:]:
+                    dn = _to_int(r[0], None)
+                    h = _to_float(r[1], None) if len(r) >= 2 else None
+                    if dn is not None and h is not None:
                         tmp[dn] = h
-                        if dn > max_day: max_day = dn
-                    except Exception:
-                        pass
-                    i+=1
+                max_day = max(tmp, default=0)
                 if max_day > 0:
                     day_caps = [0.0] * max_day
                     for dn, h in tmp.items():
-                        if 1 <= dn <= max_day:
+                        if dn >= 1:
                             day_caps[dn-1] = h
-            while i < len(rows) and not rows[i]: i+=1
+                sec = next(sections, None)
             plan_rows=[]
-            if i < len(rows) and rows[i] and rows[i][0].strip()=='Plan':
-                i+=2
-                while i < len(rows) and rows[i]:
-                    r=rows[i]
-                    try: day=int(r[0])
-                    except: i+=1; continue
-                    name=r[1]; assigned=0
-                    try: assigned=int(r[2]) if r[2] else 0
-                    except: assigned=0
-                    timeh=0.0
-                    try: timeh=float(r[3]) if r[3] else 0.0
-                    except: timeh=0.0
-                    plan_rows.append({'day':day,'name':name,'assigned':assigned,'time':timeh})
-                    i+=1
+            if sec and sec[0][0].strip()=='Plan':
+                for r in sec[2:]:
+                    day = _to_int(r[0], None)
+                    if day is None: continue
+                    r += ['', '', '']
+                    plan_rows.append(PlanRow(day, r[1], _to_int(r[2]), _to_float(r[3])))
             plan_data={'meta':meta,'day_capacities':day_caps,'plan_rows':plan_rows}
 
         self.loaded_meta = plan_data['meta']
@@ -327,87 +363,117 @@ class PlannerGUI(tk.Tk):
         # store day capacities as well for later saving/再計画保存時に利用
         self.loaded_day_caps = plan_data.get('day_capacities', [])
         # print summary
-        self.txt_update.delete('1.0','end')
-        self.txt_update.insert('end', f"読み込み: {os.path.basename(fpath)}\nメタ情報: {self.loaded_meta}\n\n")
+        parts = [f"読み込み: {os.path.basename(fpath)}\nメタ情報: {self.loaded_meta}\n\n"]
         
         # 読み込まれた全データをDay別に表示
-        days_data = {}
+        days_data = defaultdict(list)
         for r in self.loaded_plan_rows:
-            if not str(r.get('name','')).strip(): continue
-            day = r.get('day', 0)
-            if day not in days_data:
-                days_data[day] = []
-            days_data[day].append(f"{r['name']} {r['assigned']}問")
+            if not r.name.strip(): continue
+            days_data[r.day].append(f"{r.name} {r.assigned}問")
         
-        self.txt_update.insert('end', "読み込まれたデータ（Day別）:\n")
+        parts.append("読み込まれたデータ（Day別）:\n")
         for day in sorted(days_data.keys()):
             tasks_str = ', '.join(days_data[day])
-            self.txt_update.insert('end', f"  Day {day}: {tasks_str}\n")
-        self.txt_update.insert('end', "\n")
+            parts.append(f"  Day {day}: {tasks_str}\n")
+        parts.append("\n")
         
         # タスク一覧を作る
-        tasks_info = {}
+        tasks_info = defaultdict(lambda: {'total':0,'today':0,'prev':0})
         for r in self.loaded_plan_rows:
             # 空文字のタスク名行は集計対象外
-            if not str(r.get('name','')).strip(): continue
-            if r['name'] not in tasks_info: tasks_info[r['name']]={'total':0,'today':0,'prev':0}
-            tasks_info[r['name']]['total'] += r['assigned']
+            if not r.name.strip(): continue
+            tasks_info[r.name]['total'] += r.assigned
         for name,info in tasks_info.items():
-            self.txt_update.insert('end', f"{name}: 合計割当 {info['total']}\n")
+            parts.append(f"{name}: 合計割当 {info['total']}\n")
+        self.txt_update.delete('1.0','end')
+        self.txt_update.insert('end', ''.join(parts))
+
+    def _ask_done_counts(self, items, today):
+        # 今日の完了数を、タスクごとの入力欄を並べた 1 つのダイアログでまとめて入力してもらう
+        # items は (タスク名, デフォルト値) の並びで、{タスク名: 完了数} を返す
+        # 空欄やダイアログを閉じた場合はデフォルト値、数値でない入力は 0 とする
+        if not items:
+            # 入力するタスクが無ければダイアログは出さない
+            return {}
+        top = tk.Toplevel(self)
+        top.title('完了数入力')
+        top.transient(self)
+        ttk.Label(top, text=f'Day {today} に実際に完了した数を入力してください').grid(row=0, column=0, columnspan=3, sticky='w', padx=8, pady=(8, 4))
+        entries = []
+        for row, (name, suggested) in enumerate(items, start=1):
+            if suggested > 0:
+                plan_text = f'計画={suggested}問'
+            else:
+                # 計画外のタスク（今日の計画=0だが、全体には存在する）
+                plan_text = '計画=0問（計画外）'
+            ttk.Label(top, text=name).grid(row=row, column=0, sticky='w', padx=8)
+            ttk.Label(top, text=plan_text).grid(row=row, column=1, sticky='w', padx=4)
+            e = ttk.Entry(top, width=8)
+            e.insert(0, str(suggested))
+            e.grid(row=row, column=2, padx=8, pady=2)
+            entries.append(e)
+
+        values = {}
+        def on_ok(event=None):
+            for (name, _), e in zip(items, entries):
+                values[name] = e.get()
+            top.destroy()
+        ttk.Button(top, text='OK', command=on_ok).grid(row=len(items)+1, column=0, columnspan=3, pady=8)
+        top.bind('<Return>', on_ok)
+        # 表示される前に grab すると X11 で "window not viewable" になるため、表示を待ってから grab する
+        top.wait_visibility()
+        top.grab_set()
+        entries[0].focus_set()
+        self.wait_window(top)
+
+        done = {}
+        for name, suggested in items:
+            s = values.get(name)
+            if s is None or s.strip() == '':
+                done[name] = int(suggested)
+            else:
+                done[name] = _to_int(s)
+        return done
 
     def _apply_today_replan(self):
         if not self.loaded_plan_rows:
             messagebox.showwarning('警告','まずCSVを読み込んでください')
             return
-        try:
-            today = int(self.entry_today.get().strip() or '1')
-        except Exception:
-            today = 1
+        # 空欄や数値でない入力は Day 1 とみなす
+        today = _to_int(self.entry_today.get(), 1)
         # aggregate tasks
-        tasks = {}
+        # 1 回の走査で、タスクごとの合計・過去 (today より前)・今日の割当もまとめて集計する
+        # first_day は最初の行で必ず小さい値に置き換わるよう sys.maxsize から始める
+        tasks = defaultdict(lambda: {'total_assigned':0, 'prev':0, 'today':0, 'sum_tpi':0.0, 'count_tpi':0, 'first_day':sys.maxsize})
         for r in self.loaded_plan_rows:
             # 空文字のタスク名行は集計対象外
-            raw_name = r.get('name', '')
-            if not str(raw_name).strip(): continue
+            if not r.name.strip(): continue
             # タスク名を正規化してキーとして使う（空白を統一）
-            n_key = str(raw_name).strip()
-            info = tasks.setdefault(n_key, {'total_assigned':0, 'time_per_item_samples':[], 'first_day':r['day']})
-            info['total_assigned'] += r['assigned']
-            if r['assigned']>0:
-                info['time_per_item_samples'].append(r['time']/r['assigned'] if r['assigned'] else 0)
-            info['first_day'] = min(info['first_day'], r['day'])
-
-        # prompt user for done_today values via simple dialog loop
+            n_key = r.name.strip()
+            info = tasks[n_key]
+            info['total_assigned'] += r.assigned
+            if r.day < today:
+                info['prev'] += r.assigned
+            elif r.day == today:
+                info['today'] += r.assigned
+            if r.assigned>0:
+                # 1問あたり時間はサンプルを溜めず、合計と件数だけ持って平均を出す
+                info['sum_tpi'] += r.time/r.assigned
+                info['count_tpi'] += 1
+            if r.day < info['first_day']:
+                info['first_day'] = r.day
+
+        # prompt user for done_today values (one dialog for all tasks)
         # ダイアログの提示順を安定させるため、明示的に優先度（first_day）→名前順でソートして表示する
         ordered = sorted(tasks.items(), key=lambda kv: (kv[1].get('first_day', 0), kv[0]))
+        # デフォルトは今日の計画数（全部やった想定）。全タスク分を 1 つのダイアログでまとめて入力してもらう
+        entered = self._ask_done_counts([(name, max(info['today'], 0)) for name, info in ordered], today)
         done_today = {}
         for name, info in ordered:
             # name は既に正規化済み（tasks 辞書作成時に strip 済み）
-            prev = sum(int(r.get('assigned', 0)) for r in self.loaded_plan_rows if str(r.get('name', '')).strip() == name and int(r.get('day', 0)) < today)
-            today_assigned = sum(int(r.get('assigned', 0)) for r in self.loaded_plan_rows if str(r.get('name', '')).strip() == name and int(r.get('day', 0)) == today)
-            future_assigned = sum(int(r.get('assigned', 0)) for r in self.loaded_plan_rows if str(r.get('name', '')).strip() == name and int(r.get('day', 0)) > today)
-            
-            # デフォルトは今日の計画数（全部やった想定）
-            suggested = today_assigned
-            if suggested < 0:
-                suggested = 0
-            
-            # プロンプトメッセージ
-            if today_assigned > 0:
-                prompt = f"{name}: Day {today}の計画={today_assigned}問 -> 実際に完了した数 (デフォルト {suggested}): "
-            else:
-                # 計画外のタスク（今日の計画=0だが、全体には存在する）
-                prompt = f"{name}: Day {today}の計画=0問（計画外）-> 実際に完了した数があれば入力 (デフォルト 0): "
-            
-            s = tk.simpledialog.askstring('完了数入力', prompt)
-            if s is None or s.strip() == '':
-                done = int(suggested)
-            else:
-                try:
-                    done = int(s.strip())
-                except Exception:
-                    done = 0
-            
+            prev = info['prev']
+            done = entered[name]
+
             # 入力値のバリデーション: 0以上、全体の残り数以下
             total_remaining = info['total_assigned'] - prev
             if done < 0:
@@ -424,11 +490,10 @@ class PlannerGUI(tk.Tk):
 
         # 次の日の利用可能時間を入力してもらう（1日分のみ）
         # それ以降の日は元CSVの day_capacities を使用
-        s = tk.simpledialog.askstring('次の日入力', f'次の日（Day {today+1}）の利用可能時間を入力してください（例:3）:')
+        s = simpledialog.askstring('次の日入力', f'次の日（Day {today+1}）の利用可能時間を入力してください（例:3）:')
         if s is None: return
-        try:
-            next_day_cap = float(s.strip())
-        except Exception:
+        next_day_cap = _to_float(s, None)
+        if next_day_cap is None:
             messagebox.showwarning('警告', f'数値を入力してください。入力値: "{s}"')
             return
         
@@ -446,19 +511,25 @@ class PlannerGUI(tk.Tk):
         # cutoff_day を確定（today の次の日から next_caps の期間を再計画）
         cutoff_day = today + len(next_caps)
 
+        # 再計画ウィンドウ（today より後から cutoff_day まで）のタスクごとの割当を 1 回の走査で集計し、
+        # 以下のデバッグ出力と残りタスクの計算で使い回す
+        future_by_task = dict.fromkeys(tasks, 0)
+        for r in self.loaded_plan_rows:
+            if today < r.day <= cutoff_day:
+                n_key = r.name.strip()
+                if n_key: future_by_task[n_key] += r.assigned
+
         # --- デバッグ出力: ユーザー入力とウィンドウ内の差分を表示して確認できるようにする ---
         debug_lines = [f"デバッグ: today={today}, cutoff_day={cutoff_day}, next_caps長={len(next_caps)}"]
         debug_lines.append("完了数サマリ（タスク名 / 過去+今日の割当 / 今日の計画 / 入力完了 / 未来の割当 / 残り）:")
         for name, info in ordered:
             # name は既に正規化済み
             # 過去+今日: today 以前（today を含む）- これらは固定
-            past_and_today_rows = [(r.get('day'), r.get('assigned')) for r in self.loaded_plan_rows if str(r.get('name', '')).strip() == name and int(r.get('day', 0)) <= today]
-            past_and_today = sum(int(assigned) for day, assigned in past_and_today_rows)
+            past_and_today = info['prev'] + info['today']
             # 今日の計画: today の割当
-            today_plan = sum(int(r.get('assigned', 0)) for r in self.loaded_plan_rows if str(r.get('name', '')).strip() == name and int(r.get('day', 0)) == today)
+            today_plan = info['today']
             # 再計画ウィンドウ（未来）: today より後から cutoff_day まで
-            future_rows = [(r.get('day'), r.get('assigned')) for r in self.loaded_plan_rows if str(r.get('name', '')).strip() == name and today < int(r.get('day', 0)) <= cutoff_day]
-            future_plan = sum(int(assigned) for day, assigned in future_rows)
+            future_plan = future_by_task[name]
             done = done_today.get(name, 0)  # 正規化済みキーで取得
             # 残り計算: (今日の計画 + 未来) - 今日の完了
             # 計画外完了の場合、未来から差し引く
@@ -480,15 +551,15 @@ class PlannerGUI(tk.Tk):
         for name,info in tasks.items():
             # name は既に正規化済み（tasks 辞書作成時に strip 済み）
             # 今日の計画: today の割当
-            today_plan = sum(r['assigned'] for r in self.loaded_plan_rows if str(r.get('name','')).strip()==name and r['day']==today)
+            today_plan = info['today']
             # 未来の割当: today より後
-            future_plan = sum(r['assigned'] for r in self.loaded_plan_rows if str(r.get('name','')).strip()==name and today < r['day'] <= cutoff_day)
+            future_plan = future_by_task[name]
             # ユーザー入力分はそのタスク内で差し引く（正規化済みキーで取得）
             done = done_today.get(name, 0)
             # 残り = (今日の計画 + 未来の割当) - 完了数
             rem = today_plan + future_plan - done
             if rem < 0: rem = 0
-            tpi = (sum(info['time_per_item_samples'])/len(info['time_per_item_samples'])) if info['time_per_item_samples'] else 1.0
+            tpi = info['sum_tpi']/info['count_tpi'] if info['count_tpi'] else 1.0
             remaining_tasks.append({'name':name,'remaining':int(rem),'time_per_item':float(tpi),'difficulty':1.0,'priority':int(info['first_day'])})
 
         # allocate using first_mod.allocate_by_priority
@@ -523,16 +594,20 @@ class PlannerGUI(tk.Tk):
             messagebox.showwarning('時間不足', warning_msg)
 
         # render replan + remaining original future days in calendar view
+        # base_for_print: 再計画初日の日付（ラベル計算用に保持し、new_start を再解析しない）
+        base_for_print = None
         try:
             if self.loaded_meta.get('start_date'):
                 base_date = datetime.fromisoformat(self.loaded_meta.get('start_date')).date()
                 # 再計画は today の次の日から始まる（today は完了済み）
                 start_day = today + 1
-                new_start = (base_date + timedelta(days=(today))).isoformat()
+                base_for_print = base_date + timedelta(days=(today))
+                new_start = base_for_print.isoformat()
             else:
                 new_start = None
                 start_day = today + 1
         except Exception:
+            base_for_print = None
             new_start = None
             start_day = today + 1
 
@@ -540,28 +615,14 @@ class PlannerGUI(tk.Tk):
 
         # collect future days from loaded_plan_rows where day > cutoff_day and append after replan
         cutoff_day = today + len(next_caps)
-        future_days_map = {}
-        max_future_day = cutoff_day
-        for r in self.loaded_plan_rows:
-            try:
-                d = int(r.get('day', 0))
-            except Exception:
-                continue
-            if d > cutoff_day:
-                max_future_day = max(max_future_day, d)
-                future_days_map.setdefault(d, []).append({'name': r.get('name'), 'assigned': int(r.get('assigned',0)), 'time': float(r.get('time',0.0))})
-
+        # 対象行を日順に並べ（安定ソートなので同じ日の中は元の順のまま）、groupby で日ごとにまとめる。
+        # 行の無い日は [] で埋め、空のタスク名（以前の '(休憩/学習無し)' を含む）の行は除外する
+        future_rows = sorted((r for r in self.loaded_plan_rows if r.day > cutoff_day), key=attrgetter('day'))
         future_plan = []
-        if future_days_map:
-            for daynum in range(cutoff_day+1, max_future_day+1):
-                day_tasks = future_days_map.get(daynum, [])
-                # 空のタスク名（以前の '(休憩/学習無し)' を含む）を除外する
-                filtered = [t for t in day_tasks if t.get('name') and t.get('name').strip() != '']
-                if filtered:
-                    conv = [{'name': t['name'], 'assigned': t['assigned'], 'time': t['time']} for t in filtered]
-                else:
-                    conv = []
-                future_plan.append(conv)
+        if future_rows:
+            future_plan = [[] for _ in range(future_rows[-1].day - cutoff_day)]
+            for daynum, grp in groupby(future_rows, key=attrgetter('day')):
+                future_plan[daynum - cutoff_day - 1] = [{'name': r.name, 'assigned': r.assigned, 'time': r.time} for r in grp if r.name.strip()]
 
         combined_plan = []
         combined_plan.extend(plan)
@@ -570,125 +631,98 @@ class PlannerGUI(tk.Tk):
 
         # print combined plan in original (per-day) format
         # デバッグサマリは既に表示済みなので、削除せずに追記する
-        self.txt_update.insert('end', f"\n再計画（開始 Day {start_day}）:\n\n")
-        # base date for label calculation
-        base_for_print = None
-        if new_start:
-            try:
-                base_for_print = datetime.fromisoformat(new_start).date()
-            except Exception:
-                base_for_print = None
-        for idx, day_tasks in enumerate(combined_plan, start=start_day):
-            label = f"Day {idx}"
-            if base_for_print:
-                try:
-                    d = base_for_print + timedelta(days=(idx - start_day))
-                    label += f" ({d.month}/{d.day})"
-                except Exception:
-                    pass
-            self.txt_update.insert('end', f"{label}:\n")
+        parts = [f"\n再計画（開始 Day {start_day}）:\n\n"]
+        # 日付ラベルは描画ループの外で、序数（toordinal）から date.fromordinal で先にまとめて作る
+        n_days = len(combined_plan)
+        labels = [f"Day {start_day+i}" for i in range(n_days)]
+        if base_for_print:
+            ord0 = base_for_print.toordinal()
+            # date.max を超える日はラベルに日付を付けない
+            for i in range(min(n_days, date.max.toordinal() - ord0 + 1)):
+                d = date.fromordinal(ord0 + i)
+                labels[i] += f" ({d.month}/{d.day})"
+        # 保存用に、再計画した日の CSV 行と合計時間も描画と同じ走査で作っておく
+        pending_csv_rows = []
+        combined_total_time = 0.0
+        for day, (label, day_tasks) in enumerate(zip(labels, combined_plan), start=start_day):
+            parts.append(f"{label}:\n")
             if not day_tasks:
-                # 空日はプレースホルダを出さない
-                pass
+                # 空日はプレースホルダを出さない（CSV ではタスク名を空文字で出力する）
+                pending_csv_rows.append([day, '', '', ''])
             else:
                 for it in day_tasks:
-                    self.txt_update.insert('end', f"  - {it['name']} を {it['assigned']} 問 合計 {it['time']:.2f} 時間\n")
-            self.txt_update.insert('end','\n')
+                    parts.append(f"  - {it['name']} を {it['assigned']} 問 合計 {it['time']:.2f} 時間\n")
+                    pending_csv_rows.append([day, it['name'], it['assigned'], f"{it['time']:.2f}"])
+                    combined_total_time += float(it['time'])
+            parts.append('\n')
+        self.txt_update.insert('end', ''.join(parts))
 
         # ask to save
         if messagebox.askyesno('保存確認','この再計画を保存しますか？'):
             fname = filedialog.asksaveasfilename(initialdir=PLANS_DIR, defaultextension='.csv', filetypes=[('CSVファイル','*.csv')])
             if fname:
-                with open(fname,'w',newline='',encoding='utf-8') as f:
-                    w = csv.writer(f)
-                    # header meta
-                    w.writerow(['subject', self.loaded_meta.get('subject','(無題)')])
-                    w.writerow(['generated_at', datetime.now().isoformat()])
-
-                    # Build full day capacities array: ensure we include original loaded days and any new days from combined_plan
-                    orig_caps = getattr(self, 'loaded_day_caps', []) or []
-                    combined_len = start_day + len(combined_plan) - 1
-                    total_days = max(len(orig_caps), combined_len)
-                    full_day_caps = [0.0] * total_days
-                    for idx in range(total_days):
-                        if idx < len(orig_caps):
-                            full_day_caps[idx] = orig_caps[idx]
-                        else:
-                            full_day_caps[idx] = 0.0
-
-                    total_available = sum(full_day_caps)
-                    # total_needed: sum of hours in the combined_plan
-                    combined_total_time = 0.0
-                    for day_tasks in combined_plan:
-                        for it in day_tasks:
-                            combined_total_time += float(it.get('time', 0.0))
-
-                    w.writerow(['total_available', f"{total_available:.2f}"])
-                    w.writerow(['total_needed', f"{combined_total_time:.2f}"])
-
-                    # preserve start_date/test_date if present; update start_date to the original start if available
-                    try:
-                        if self.loaded_meta.get('start_date'):
-                            # keep original start_date
-                            w.writerow(['start_date', self.loaded_meta.get('start_date')])
-                    except Exception:
-                        pass
-                    if self.loaded_meta.get('test_date'):
-                        w.writerow(['test_date', self.loaded_meta.get('test_date')])
-
-                    w.writerow([])
-                    w.writerow(['Day Capacities'])
-                    w.writerow(['Day','AvailableHours'])
-                    for i, h in enumerate(full_day_caps, start=1):
-                        w.writerow([i, f"{h:.2f}"])
-
-                    # Plan: write rows for day=1..total_days, combining past original rows and new combined_plan
-                    w.writerow([])
-                    w.writerow(['Plan'])
-                    w.writerow(['Day','Task','Assigned','Time(hours)'])
-
-                    # Build map of original plan rows by day
-                    orig_map = {}
-                    for r in self.loaded_plan_rows:
-                        try:
-                            d = int(r.get('day', 0))
-                        except Exception:
-                            continue
-                        orig_map.setdefault(d, []).append(r)
-
-                    for day in range(1, total_days+1):
-                        if day <= today:
-                            # past days and today (completed): write original rows (if any)
-                            rows = orig_map.get(day, [])
-                            if not rows:
-                                w.writerow([day, '', '', ''])
-                            else:
-                                for rr in rows:
-                                    name = rr.get('name','') or ''
-                                    assigned = int(rr.get('assigned',0)) if rr.get('assigned', '')!='' else ''
-                                    timeh = float(rr.get('time',0.0)) if rr.get('time', '')!='' else ''
-                                    w.writerow([day, name, assigned, f"{timeh:.2f}" if timeh!='' else ''])
+                # header meta
+                meta_rows = [
+                    ('subject', self.loaded_meta.get('subject','(無題)')),
+                    ('generated_at', datetime.now().isoformat()),
+                ]
+
+                # Build full day capacities array: ensure we include original loaded days and any new days from combined_plan
+                orig_caps = getattr(self, 'loaded_day_caps', []) or []
+                combined_len = start_day + len(combined_plan) - 1
+                total_days = max(len(orig_caps), combined_len)
+                full_day_caps = [0.0] * total_days
+                for idx in range(total_days):
+                    if idx < len(orig_caps):
+                        full_day_caps[idx] = orig_caps[idx]
+                    else:
+                        full_day_caps[idx] = 0.0
+
+                total_available = sum(full_day_caps)
+                # total_needed: sum of hours in the combined_plan（描画時に集計済み）
+
+                meta_rows.append(('total_available', f"{total_available:.2f}"))
+                meta_rows.append(('total_needed', f"{combined_total_time:.2f}"))
+
+                # preserve start_date/test_date if present; update start_date to the original start if available
+                try:
+                    if self.loaded_meta.get('start_date'):
+                        # keep original start_date
+                        meta_rows.append(('start_date', self.loaded_meta.get('start_date')))
+                except Exception:
+                    pass
+                if self.loaded_meta.get('test_date'):
+                    meta_rows.append(('test_date', self.loaded_meta.get('test_date')))
+
+                # Plan: write rows for day=1..total_days, combining past original rows and new combined_plan
+
+                # Build map of original plan rows by day
+                orig_map = defaultdict(list)
+                for r in self.loaded_plan_rows:
+                    orig_map[r.day].append(r)
+
+                def orig_day_rows(days):
+                    # 元の行（無ければ空行）をそのまま書く
+                    for day in days:
+                        rows = orig_map.get(day)
+                        if not rows:
+                            yield [day, '', '', '']
                         else:
-                            # future/replanned days (after today)
-                            if start_day <= day < start_day + len(combined_plan):
-                                rel = day - start_day
-                                day_tasks = combined_plan[rel]
-                                if not day_tasks:
-                                    w.writerow([day, '', '', ''])
-                                else:
-                                    for it in day_tasks:
-                                        w.writerow([day, it.get('name',''), it.get('assigned',0), f"{it.get('time',0.0):.2f}"])
-                            else:
-                                # if original had tasks for this day, write them; otherwise empty
-                                rows = orig_map.get(day, [])
-                                if not rows:
-                                    w.writerow([day, '', '', ''])
-                                else:
-                                    for rr in rows:
-                                        name = rr.get('name','') or ''
-                                        assigned = int(rr.get('assigned',0)) if rr.get('assigned', '')!='' else ''
-                                        timeh = float(rr.get('time',0.0)) if rr.get('time', '')!='' else ''
-                                        w.writerow([day, name, assigned, f"{timeh:.2f}" if timeh!='' else ''])
+                            for rr in rows:
+                                yield [day, rr.name, rr.assigned, f"{rr.time:.2f}"]
+
+                # past days and today (completed): write original rows (if any)
+                out_rows = list(orig_day_rows(range(1, start_day)))
+                # future/replanned days (after today): 描画時に作った行をそのまま使う
+                out_rows.extend(pending_csv_rows)
+                # days after the replanned range: original rows (if any)
+                out_rows.extend(orig_day_rows(range(start_day + len(combined_plan), total_days+1)))
+
+                # 形式が決まっている先頭部分（メタ情報・日別容量）は文字列で直接書き、
+                # タスク名を含む Plan 行だけを csv.writer でまとめて書き出す
+                with open(fname,'w',newline='',encoding='utf-8',buffering=1 << 20) as f:
+                    f.write(_plan_csv_head(meta_rows, full_day_caps))
+                    csv.writer(f).writerows(out_rows)
                 messagebox.showinfo('保存完了', f'プランを保存しました: {fname}')
 
 